@@ -0,0 +1,416 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+    vimg - Simple GTK Image Viewer for shell lovers.
+
+    This file is part of vimg.
+
+    vimg is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License version 3
+    as published by the Free Software Foundation.
+
+    vimg is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with vimg. If not, see <http://www.gnu.org/licenses/>.
+
+    Author: Leonardo Vidarte <http://nerdlabs.com.ar>
+
+    Animated GIF playback.
+
+"""
+
+import gtk
+import glib
+import os
+import time
+from bisect import bisect_right
+
+ANIMATION_FORMATS = ('gif',)
+
+FEED_SIZE = 64 * 1024 # bytes decoded on each idle call
+FRAME_CACHE_BYTES = 64 * 1024 * 1024 # scaled frames kept in memory
+LOADER_MAX_BYTES = 256 * 1024 * 1024 # decoded frames kept by gdk-pixbuf
+MIN_DELAY = 20 # ms
+LOADING_DELAY = 100 # ms to wait for a frame still being decoded
+
+
+def check_animation(filename):
+    return filename.split('.')[-1].lower() in ANIMATION_FORMATS
+
+
+def get_gif_delay(centiseconds):
+    # Same limits gdk-pixbuf applies to GIF frame delays
+    delay = centiseconds * 10
+    if delay == 0:
+        delay = 100
+    return max(delay, 20)
+
+
+class GifScanner:
+    '''Walk the block structure of a GIF as its data is read, without
+    decoding it, and collect the delay of each frame:
+
+        scanner = GifScanner()
+        scanner.feed(data)          # as many times as needed
+        scanner.delays              # ms, one per frame found so far
+        scanner.ends                # ms since start when each frame ends
+        scanner.done                # trailer found
+        scanner.width, scanner.height   # logical screen size
+
+    Only block headers are kept in memory, image data is skipped.
+
+    '''
+
+    def __init__(self):
+        self.delays = []
+        self.ends = []
+        self.width = self.height = 0
+        self.done = False
+        self.error = False
+        self.delay = 0 # last graphic control extension
+        self.state = self.read_header
+        self.buffer = ''
+        self.skip = 0
+
+    def feed(self, data):
+        if self.done or self.error:
+            return
+        self.buffer += data
+        while self.state():
+            pass
+
+    def read(self, size):
+        '''read(size) -> string, None if more data is needed'''
+        if self.skip:
+            skipped = min(self.skip, len(self.buffer))
+            self.buffer = self.buffer[skipped:]
+            self.skip -= skipped
+            if self.skip:
+                return None
+        if len(self.buffer) < size:
+            return None
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def stop(self, error=False):
+        self.done = not error
+        self.error = error
+        self.buffer = ''
+        return False
+
+    def read_header(self):
+        data = self.read(13)
+        if data is None:
+            return False
+        if data[:3] != 'GIF':
+            return self.stop(error=True)
+        self.width = ord(data[6]) | ord(data[7]) << 8
+        self.height = ord(data[8]) | ord(data[9]) << 8
+        flags = ord(data[10])
+        if flags & 0x80: # global color table
+            self.skip += 3 << ((flags & 0x07) + 1)
+        self.state = self.read_block
+        return True
+
+    def read_block(self):
+        data = self.read(1)
+        if data is None:
+            return False
+        # Trailer
+        if data == '\x3b':
+            return self.stop()
+        # Extension
+        elif data == '\x21':
+            self.state = self.read_extension
+        # Image
+        elif data == '\x2c':
+            self.state = self.read_image
+        else:
+            return self.stop(error=True)
+        return True
+
+    def read_extension(self):
+        data = self.read(1)
+        if data is None:
+            return False
+        if data == '\xf9':
+            self.state = self.read_graphic_control
+        else:
+            self.state = self.read_sub_blocks
+        return True
+
+    def read_graphic_control(self):
+        data = self.read(4)
+        if data is None:
+            return False
+        self.delay = ord(data[2]) | ord(data[3]) << 8
+        # rest of the sub-block, usually the transparent color index
+        self.skip += max(ord(data[0]) - 3, 0)
+        self.state = self.read_sub_blocks
+        return True
+
+    def read_image(self):
+        data = self.read(9) # image descriptor
+        if data is None:
+            return False
+        flags = ord(data[8])
+        if flags & 0x80: # local color table
+            self.skip += 3 << ((flags & 0x07) + 1)
+        self.state = self.read_lzw_size
+        delay = get_gif_delay(self.delay)
+        self.delays.append(delay)
+        self.ends.append(delay + (self.ends[-1] if self.ends else 0))
+        return True
+
+    def read_lzw_size(self):
+        if self.read(1) is None:
+            return False
+        self.state = self.read_sub_blocks
+        return True
+
+    def read_sub_blocks(self):
+        data = self.read(1)
+        if data is None:
+            return False
+        if data == '\x00':
+            self.state = self.read_block
+        else:
+            self.skip += ord(data)
+        return True
+
+
+class Animation:
+    '''Play an animated image in a gtk.Image.
+
+    The file is fed to a gtk.gdk.PixbufLoader in small chunks from the
+    main loop, and frames are shown through the animation iterator as
+    soon as they are decoded. The same data goes through a GifScanner,
+    whose frame delays tell which frame the iterator is showing. Frames
+    are scaled to width x height once and kept in a cache of up to
+    FRAME_CACHE_BYTES, so a looping animation is not scaled again on
+    every loop. Frames are played in a cycle, where evicting old frames
+    would only make room for frames evicted before they come round
+    again, so once the cache is full the remaining frames are scaled on
+    every loop and the cached ones are kept. Frames of the previous size
+    are kept too (with their own FRAME_CACHE_BYTES), so going in and out
+    of fullscreen does not scale them again.
+
+    The cache only bounds the scaled copies: before gdk-pixbuf 2.42 the
+    loader keeps every decoded frame at full size (plus a composited
+    copy). When the frames found by the GifScanner would need more than
+    LOADER_MAX_BYTES, decoding stops and only the first frame is shown:
+
+        animation = Animation(image, path, width, height)
+        animation.start()
+        ...
+        animation.stop()
+
+    '''
+
+    def __init__(self, image, path, width, height):
+        self.image = image
+        self.path = path
+        self.mtime = os.path.getmtime(path)
+        self.width = width
+        self.height = height
+        self.frames = {} # (width, height) -> {frame: scaled pixbuf}
+        self.frames_bytes = {} # (width, height) -> bytes
+        self.still = None # first frame, when the animation is too large
+        self.scanner = GifScanner()
+        self.file = None
+        self.loader = None
+        self.iter = None
+        self.start_time = 0
+        self.elapsed = 0 # ms
+        self.loading = False
+        self.feed_source = None
+        self.frame_source = None
+
+    def start(self):
+        self.file = open(self.path, 'rb')
+        self.loader = gtk.gdk.PixbufLoader()
+        self.loader.connect('area-prepared', self.on_area_prepared)
+        self.loading = True
+        self.feed_source = glib.idle_add(self.feed)
+
+    def stop(self):
+        for source in (self.feed_source, self.frame_source):
+            if source is not None:
+                glib.source_remove(source)
+        self.feed_source = self.frame_source = None
+        if self.loading:
+            self.loading = False
+            self.file.close()
+            try:
+                self.loader.close()
+            except glib.GError:
+                pass
+        self.iter = None
+        self.still = None
+        self.frames.clear()
+        self.frames_bytes.clear()
+
+    def set_size(self, width, height):
+        '''Show the animation at a new size.'''
+        # Only the frames of the current and the previous size are kept
+        keep = ((self.width, self.height), (width, height))
+        for size in self.frames.keys():
+            if size not in keep:
+                del self.frames[size]
+                self.frames_bytes.pop(size, None)
+        self.width = width
+        self.height = height
+        if self.still is not None:
+            self.show_still()
+        elif self.iter is not None:
+            self.show_frame()
+
+    def get_loader_bytes(self):
+        '''get_loader_bytes() -> int
+
+        Memory the loader needs for the frames found so far, each one
+        kept at full size and composited.
+
+        '''
+        scanner = self.scanner
+        return len(scanner.delays) * scanner.width * scanner.height * 4 * 2
+
+    def feed(self):
+        try:
+            data = self.file.read(FEED_SIZE)
+            if data:
+                self.scanner.feed(data)
+                # The first frame is always decoded
+                if len(self.scanner.delays) <= 1 or \
+                        self.get_loader_bytes() <= LOADER_MAX_BYTES:
+                    self.loader.write(data)
+                    return True
+                print("%s: animation too large, showing first frame" % (
+                                                                self.path))
+                self.stop_loader()
+            else:
+                self.loader.close()
+        except glib.GError, e:
+            print("%s: %s" % (self.path, e.message))
+            self.scanner.stop(error=True)
+        except IOError, e:
+            print("%s: %s" % (self.path, e))
+            self.scanner.stop(error=True)
+            try:
+                self.loader.close()
+            except glib.GError:
+                pass
+        self.loading = False
+        self.file.close()
+        self.feed_source = None
+        return False
+
+    def stop_loader(self):
+        # Keep a copy of the first frame and release all decoded frames
+        if self.iter is not None:
+            animation = self.loader.get_animation()
+            self.still = animation.get_iter(self.start_time).get_pixbuf().copy()
+        if self.frame_source is not None:
+            glib.source_remove(self.frame_source)
+            self.frame_source = None
+        try:
+            self.loader.close()
+        except glib.GError:
+            pass
+        self.loader = None
+        self.iter = None
+        self.frames.clear()
+        self.frames_bytes.clear()
+        if self.still is not None:
+            self.show_still()
+
+    def show_still(self):
+        if (self.still.get_width(), self.still.get_height()) == \
+                (self.width, self.height):
+            self.image.set_from_pixbuf(self.still)
+        else:
+            self.image.set_from_pixbuf(self.still.scale_simple(
+                self.width, self.height, gtk.gdk.INTERP_BILINEAR))
+
+    def on_area_prepared(self, loader):
+        self.start_time = time.time()
+        self.elapsed = 0
+        self.iter = loader.get_animation().get_iter(self.start_time)
+        self.show_frame()
+        self.schedule()
+
+    def schedule(self):
+        delay = self.iter.get_delay_time()
+        # Still decoding, show the new data as it arrives
+        if self.loading and self.iter.on_currently_loading_frame():
+            delay = LOADING_DELAY
+        # Last frame of the last loop
+        elif delay < 0:
+            self.frame_source = None
+            return
+        self.frame_source = glib.timeout_add(max(delay, MIN_DELAY), self.tick)
+
+    def tick(self):
+        if not (self.loading and self.iter.on_currently_loading_frame()):
+            # The clock is moved by the frame delay (instead of using the
+            # real time) so every tick shows exactly the next frame.
+            # pygtk truncates it to microseconds and gdk-pixbuf to
+            # milliseconds: the extra half millisecond keeps the iterator
+            # from stopping just before the frame boundary.
+            self.elapsed += self.iter.get_delay_time()
+            self.iter.advance(
+                self.start_time + (self.elapsed + 0.5) / 1000.0)
+        self.show_frame()
+        self.schedule()
+        return False
+
+    def show_frame(self):
+        pixbuf = self.iter.get_pixbuf()
+        if (pixbuf.get_width(), pixbuf.get_height()) == \
+                (self.width, self.height):
+            self.image.set_from_pixbuf(pixbuf)
+            return
+
+        # Frames still being decoded are not cached
+        frame = None
+        if not (self.loading and self.iter.on_currently_loading_frame()):
+            frame = self.get_frame()
+
+        size = (self.width, self.height)
+        frames = self.frames.setdefault(size, {})
+        scaled = frames.get(frame)
+        if scaled is None:
+            scaled = pixbuf.scale_simple(self.width, self.height,
+                                         gtk.gdk.INTERP_BILINEAR)
+            nbytes = scaled.get_rowstride() * scaled.get_height()
+            used = self.frames_bytes.get(size, 0)
+            if frame is not None and used + nbytes <= FRAME_CACHE_BYTES:
+                frames[frame] = scaled
+                self.frames_bytes[size] = used + nbytes
+        self.image.set_from_pixbuf(scaled)
+
+    def get_frame(self):
+        '''get_frame() -> int
+
+        Index of the frame shown by the iterator, found from the time
+        elapsed and the frame delays. None if it can't be known yet.
+
+        '''
+        ends = self.scanner.ends
+        if not ends or self.scanner.error:
+            return None
+        elapsed = self.elapsed
+        if elapsed >= ends[-1]:
+            if not self.scanner.done:
+                return None
+            elapsed %= ends[-1]
+        frame = bisect_right(ends, elapsed)
+        # Both must agree, e.g. the last frame of the last loop has no delay
+        if self.scanner.delays[frame] != self.iter.get_delay_time():
+            return None
+        return frame
@@ -0,0 +1,169 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+    vimg - Simple GTK Image Viewer for shell lovers.
+
+    This file is part of vimg.
+
+    vimg is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License version 3
+    as published by the Free Software Foundation.
+
+    vimg is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with vimg. If not, see <http://www.gnu.org/licenses/>.
+
+    Author: Leonardo Vidarte <http://nerdlabs.com.ar>
+
+    Batch mode: runs marks and command mode lines without a display.
+
+        vimg --batch script.txt -r dir
+        find dir -name '*.jpg' | vimg --batch - -j 8
+
+    Each line of the script is one of:
+
+        <N|path>        add image N (as printed by -v) or path to memory,
+                        it becomes the current image
+        :cp  <target>   copy current image to directory or filename
+        :mcp <target>   copy all images in memory to directory
+        :dups           add all duplicated images to memory
+        :q              stop
+        # ...           comment
+
+"""
+
+import os
+import sys
+from operations import (get_option_parser, get_images_list,
+                        check_filename, run_command, add_to_memory)
+from dups import DuplicateIndex
+
+
+class Batch:
+
+    def __init__(self, img_paths, jobs=1, verbose=False):
+        self.img_paths = img_paths
+        self.img_cur_index = -1 # nothing marked yet
+        self.img_mem_indexes = []
+        # Scripts can mark thousands of images, avoid list scans
+        self.img_path_indexes = {}
+        for index, path in enumerate(img_paths):
+            self.img_path_indexes.setdefault(os.path.normpath(path), index)
+        self.img_mem_set = set()
+        self.jobs = jobs
+        self.verbose = verbose
+        self.errors = 0
+
+    def run(self, lines):
+        '''run(lines) -> int
+
+        Run every line and return the number of failed lines.
+
+        '''
+        for number, line in enumerate(lines, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            if line.startswith(':'):
+                entry = line.split()
+                if entry[0] == ':q':
+                    break
+                self.execute(number, entry)
+            else:
+                self.mark(number, line)
+        return self.errors
+
+    def mark(self, number, token):
+        index = self.get_index(token)
+        if index is None:
+            self.error(number, 'E08: Image not found: %s' % token)
+            return
+        if index not in self.img_mem_set:
+            self.img_mem_set.add(index)
+            self.img_mem_indexes.append(index)
+        self.img_cur_index = index
+        if self.verbose:
+            print("[M] Added quick access for image %d." % index)
+
+    def get_index(self, token):
+        if token.isdigit():
+            index = int(token)
+            return index if index < len(self.img_paths) else None
+        path = os.path.normpath(token)
+        index = self.img_path_indexes.get(path)
+        if index is None and os.path.isfile(path) and check_filename(path):
+            index = len(self.img_paths)
+            self.img_paths.append(path)
+            self.img_path_indexes[path] = index
+        return index
+
+    def execute(self, number, entry):
+        if entry[0] == ':dups':
+            self.mark_duplicates(number)
+            return
+        if self.img_cur_index == -1:
+            path = None
+            if entry[0] == ':cp':
+                self.error(number, 'E10: No image marked yet, '
+                                   'add a path or index line first')
+                return
+        else:
+            path = self.img_paths[self.img_cur_index]
+        mem_paths = [self.img_paths[index] for index in self.img_mem_indexes]
+        message = run_command(entry, path, mem_paths, self.jobs)
+        if message.startswith('OK'):
+            if self.verbose:
+                print("%d. %s" % (number, message))
+        else:
+            self.error(number, message)
+
+    def mark_duplicates(self, number):
+        dup_index = DuplicateIndex(self.img_paths)
+        dup_index.build()
+        count = add_to_memory(self.img_mem_indexes,
+                              dup_index.get_duplicate_indexes())
+        self.img_mem_set.update(self.img_mem_indexes)
+        if self.verbose:
+            print("%d. OK: %d duplicates added to memory" % (number, count))
+
+    def error(self, number, message):
+        self.errors += 1
+        sys.stderr.write("%d. %s\n" % (number, message))
+
+
+def main():
+    parser = get_option_parser()
+    (options, args) = parser.parse_args()
+
+    if options.batch is None:
+        parser.error('--batch FILE required')
+
+    if len(args) == 0:
+        args.append('.')
+
+    img_paths = get_images_list(args, options.recursive)
+    if options.verbose:
+        print("%d images found." % len(img_paths,))
+
+    batch = Batch(img_paths, jobs=options.jobs, verbose=options.verbose)
+    if options.batch == '-':
+        errors = batch.run(sys.stdin)
+    else:
+        try:
+            script = open(options.batch)
+        except IOError as e:
+            sys.stderr.write("%s\n" % e)
+            return 2
+        with script:
+            errors = batch.run(script)
+
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
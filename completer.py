@@ -32,6 +32,7 @@ COMMANDS = {
     #':mmv'  : True,
     #':rm'   : False,
     #':mrm'  : False,
+    ':dups' : False,
     ':q'    : False,
     #'pyar'  : False,
     #'python': False,
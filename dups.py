@@ -0,0 +1,239 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+    vimg - Simple GTK Image Viewer for shell lovers.
+
+    This file is part of vimg.
+
+    vimg is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License version 3
+    as published by the Free Software Foundation.
+
+    vimg is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with vimg. If not, see <http://www.gnu.org/licenses/>.
+
+    Author: Leonardo Vidarte <http://nerdlabs.com.ar>
+
+    Duplicate detection. Like operations.py, it must not import gtk.
+
+"""
+
+import os
+import hashlib
+import threading
+import cPickle as pickle
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+
+PARTIAL_SIZE = 64 * 1024 # bytes hashed before reading the whole file
+BLOCK_SIZE = 1024 * 1024
+CACHE_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'vimg', 'hashes')
+
+
+class DuplicateIndex:
+    '''Index of byte-identical images.
+
+    Files are grouped by size, then by the hash of their first bytes
+    and finally by the hash of the whole file, so most files are never
+    read at all. Hashes are saved in cache_path keyed by path and mtime.
+
+    In each group of identical files the first one in paths is the
+    original, the rest are duplicates:
+
+        index = DuplicateIndex(paths)
+        index.start()               # build in a background thread
+        ...
+        if index.ready.is_set() and index.is_duplicate(path):
+            ...
+
+    '''
+
+    def __init__(self, paths, jobs=None, cache_path=CACHE_PATH):
+        self.paths = list(paths)
+        self.jobs = jobs or cpu_count()
+        self.cache_path = cache_path
+        self.cache = {}
+        self.cache_changed = False
+        self.groups = {}
+        self.duplicates = set()
+        self.ready = threading.Event()
+        self.thread = None
+
+    def start(self):
+        '''Build the index in a background thread.'''
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.build)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def build(self):
+        # ready is set even if something fails, :dups must not wait forever
+        try:
+            self.__build()
+        finally:
+            self.ready.set()
+
+    def __build(self):
+        self.load_cache()
+
+        stats = {}
+        mtimes = {}
+        by_size = {}
+        inodes = set()
+        for path in self.paths:
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            mtimes[path] = st.st_mtime
+            # Another spelling of a path already seen is not a copy
+            if (st.st_dev, st.st_ino) in inodes:
+                continue
+            inodes.add((st.st_dev, st.st_ino))
+            stats[path] = (st.st_size, st.st_mtime)
+            by_size.setdefault(st.st_size, []).append(path)
+
+        pool = ThreadPool(self.jobs)
+        try:
+            candidates = [g for g in by_size.values() if len(g) > 1]
+            candidates = self.split(pool, candidates, stats, partial=True)
+            candidates = self.split(pool, candidates, stats, partial=False)
+        finally:
+            pool.close()
+            pool.join()
+
+        groups = {}
+        duplicates = set()
+        for group in candidates:
+            for path in group:
+                groups[path] = group
+            duplicates.update(group[1:])
+        self.groups = groups
+        self.duplicates = duplicates
+
+        self.prune_cache(mtimes)
+        if self.cache_changed:
+            self.save_cache()
+
+    def split(self, pool, candidates, stats, partial):
+        '''split(pool, candidates, stats, partial) -> list
+
+        Split each group of candidates by hash, keeping only the
+        groups that still have more than one file.
+
+        '''
+        paths = [path for group in candidates for path in group]
+        hashes = dict(zip(paths, pool.map(
+            lambda path: self.get_hash(path, stats[path], partial), paths)))
+
+        result = []
+        for group in candidates:
+            by_hash = {}
+            for path in group:
+                if hashes[path] is not None:
+                    by_hash.setdefault(hashes[path], []).append(path)
+            result.extend(g for g in by_hash.values() if len(g) > 1)
+        return result
+
+    def get_hash(self, path, stat, partial):
+        '''get_hash(path, stat, partial) -> string'''
+        size, mtime = stat
+        # Small files are completely read by the partial hash
+        if size <= PARTIAL_SIZE:
+            partial = True
+        key = 'partial' if partial else 'full'
+
+        cache_key = os.path.abspath(path)
+        entry = self.cache.get(cache_key)
+        if not isinstance(entry, dict) or entry.get('mtime') != mtime:
+            entry = {'mtime': mtime}
+            self.cache[cache_key] = entry
+            self.cache_changed = True
+        if key not in entry:
+            try:
+                with open(path, 'rb') as f:
+                    digest = hashlib.sha1()
+                    if partial:
+                        digest.update(f.read(PARTIAL_SIZE))
+                    else:
+                        for block in iter(lambda: f.read(BLOCK_SIZE), ''):
+                            digest.update(block)
+            except IOError:
+                return None
+            entry[key] = digest.hexdigest()
+            self.cache_changed = True
+        return entry[key]
+
+    def load_cache(self):
+        # A truncated or foreign file can fail in many ways
+        try:
+            with open(self.cache_path, 'rb') as f:
+                self.cache = pickle.load(f)
+        except (IOError, EOFError, ValueError, AttributeError, ImportError,
+                IndexError, KeyError, TypeError, pickle.UnpicklingError):
+            self.cache = {}
+        if not isinstance(self.cache, dict):
+            self.cache = {}
+
+    def prune_cache(self, mtimes):
+        '''Drop entries of the indexed paths that were removed or modified
+        since hashed. mtimes has the paths that could be stat'ed.
+
+        Other entries are kept, their files may be on a volume that is
+        not mounted right now.
+
+        '''
+        for path in self.paths:
+            cache_key = os.path.abspath(path)
+            entry = self.cache.get(cache_key)
+            if entry is None:
+                continue
+            if not isinstance(entry, dict) or \
+                    entry.get('mtime') != mtimes.get(path):
+                del self.cache[cache_key]
+                self.cache_changed = True
+
+    def save_cache(self):
+        tmp_path = self.cache_path + '.tmp'
+        try:
+            if not os.path.isdir(os.path.dirname(self.cache_path)):
+                os.makedirs(os.path.dirname(self.cache_path))
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(self.cache, f, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp_path, self.cache_path)
+        except (IOError, OSError):
+            pass
+
+    def is_duplicate(self, path):
+        return path in self.duplicates
+
+    def get_copies(self, path):
+        '''get_copies(path) -> int
+
+        Number of other files identical to path.
+
+        '''
+        return len(self.groups.get(path, [path])) - 1
+
+    def get_duplicates(self):
+        '''get_duplicates() -> list
+
+        Duplicated paths, in the same order as paths.
+
+        '''
+        return [path for path in self.paths if path in self.duplicates]
+
+    def get_duplicate_indexes(self):
+        '''get_duplicate_indexes() -> list
+
+        Positions in paths of the duplicated paths.
+
+        '''
+        return [index for index, path in enumerate(self.paths)
+                if path in self.duplicates]
@@ -0,0 +1,183 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+    vimg - Simple GTK Image Viewer for shell lovers.
+
+    This file is part of vimg.
+
+    vimg is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License version 3
+    as published by the Free Software Foundation.
+
+    vimg is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with vimg. If not, see <http://www.gnu.org/licenses/>.
+
+    Author: Leonardo Vidarte <http://nerdlabs.com.ar>
+
+    Image discovery and command mode operations.
+    This module must not import gtk, it is shared with the batch mode.
+
+"""
+
+import os
+import shutil
+from optparse import OptionParser
+from multiprocessing.pool import ThreadPool
+
+VERSION = '0.0.3'
+
+IMAGE_FORMATS = ('png', 'jpg', 'jpeg', 'gif', 'tif')
+
+
+def get_option_parser():
+    parser = OptionParser(prog="vimg",
+        description="Simple GTK Image Viewer for shell lovers.",
+        usage="%prog [OPTIONS] [FILE..|DIR]",
+        version="%%prog v%s" % VERSION)
+
+    parser.add_option('-r', '--recursive', action='store_true')
+    parser.add_option('-v', '--verbose', action='store_true')
+    parser.add_option('-k', '--kinetic', action='store_true',
+            help='keep scrolling after a mouse drag is released')
+    parser.add_option('-u', '--unique', action='store_true',
+            help='skip identical copies of an image while browsing')
+    parser.add_option('-b', '--batch', metavar='FILE',
+            help='run marks and commands from FILE (- for stdin) '
+                 'without opening a window')
+    parser.add_option('-j', '--jobs', type='int', default=1,
+            help='number of concurrent copies in batch mode')
+
+    return parser
+
+
+def get_images_list(args, recursive=None):
+
+    images = []
+    # Args is a directory
+    if len(args) == 1 and os.path.isdir(args[0]):
+        dir = args[0]
+        if recursive:
+            for dirname, dirnames, filenames in os.walk(dir):
+                for filename in filenames:
+                    if check_filename(filename):
+                        images.append(os.path.join(dirname, filename))
+        else:
+            for filename in os.listdir(dir):
+                if check_filename(filename):
+                    images.append(os.path.join(dir, filename))
+    # Filenames
+    else:
+        for filename in args:
+            if os.path.isfile(filename) and check_filename(filename):
+                images.append(filename)
+
+    return images
+
+
+def check_filename(filename):
+    return filename.split('.')[-1].lower() in IMAGE_FORMATS
+
+
+def add_to_memory(mem_indexes, indexes):
+    '''add_to_memory(mem_indexes, indexes) -> int
+
+    Append to the memory list mem_indexes the image indexes not already
+    in it. Returns the number of images added.
+
+    '''
+    marked = set(mem_indexes)
+    count = 0
+    for index in indexes:
+        if index not in marked:
+            marked.add(index)
+            mem_indexes.append(index)
+            count += 1
+    return count
+
+
+def run_command(entry, path, mem_paths, jobs=1):
+    '''run_command(entry, path, mem_paths, jobs=1) -> string
+
+    Run a command mode line already split in words (:q is left to the
+    caller). path is the current image and mem_paths the images in the
+    memory list. Returns the message to show.
+
+    '''
+    target = entry[1] if len(entry) == 2 else None
+    # Copy
+    if entry[0] == ':cp':
+        return copy_image(path, target)
+    # Mem Copy
+    elif entry[0] == ':mcp':
+        return copy_images(mem_paths, target, jobs)
+    # Unknown
+    else:
+        return 'E01: Command unknown'
+
+
+def copy_image(path, target):
+    '''copy_image(path, target) -> string
+
+    Copy one image, as done by :cp. Returns the message to show.
+
+    '''
+    if target is None:
+        return 'E02: Target directory or filepath required'
+    try:
+        shutil.copy2(os.path.abspath(path), os.path.abspath(target))
+    # shutil.Error (same file) and OSError (copystat) included
+    except EnvironmentError as e:
+        return e.__str__()
+    return 'OK: File copied'
+
+
+def copy_images(paths, target, jobs=1):
+    '''copy_images(paths, target, jobs=1) -> string
+
+    Copy several images into the target directory, as done by :mcp.
+    With jobs > 1 the copies run concurrently. Returns the message to show.
+
+    '''
+    if len(paths) == 0:
+        return "E04: Memory is empty (Try `m' to add)"
+    if target is None:
+        return 'E03: Target directory required'
+    if not os.path.exists(target):
+        return 'E05: Target directory do not exist'
+    if not os.path.isdir(target):
+        return 'E06: Target must be a directory'
+
+    filenames = []
+    for path in paths:
+        filename = os.path.basename(path)
+        if filename in filenames:
+            return 'E07: Files have same name: Abort copy'
+        filenames.append(filename)
+
+    target = os.path.abspath(target)
+    copy = lambda path: copy_image(
+            path, os.path.join(target, os.path.basename(path)))
+    if jobs > 1 and len(paths) > 1:
+        pool = ThreadPool(min(jobs, len(paths)))
+        try:
+            messages = pool.map(copy, paths)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        messages = []
+        for path in paths:
+            messages.append(copy(path))
+            if not messages[-1].startswith('OK'):
+                break
+
+    for message in messages:
+        if not message.startswith('OK'):
+            return message
+    return 'OK: Files copied'
@@ -30,17 +30,26 @@
 
 """
 
-import gtk
 import os
 import sys
+
+# Batch mode runs without a display, so it has to start before gtk
+if __name__ == "__main__":
+    from operations import get_option_parser
+    if get_option_parser().parse_args()[0].batch:
+        from batch import main
+        sys.exit(main())
+
+import gtk
 import glib
-import shutil
-from optparse import OptionParser
 from completer import Completer, COMMANDS
+from operations import (get_option_parser, get_images_list,
+                        run_command, add_to_memory)
+from dups import DuplicateIndex
+from animation import Animation, check_animation
 
-VERSION = '0.0.3'
-
-IMAGE_FORMATS = ('png', 'jpg', 'jpeg', 'gif', 'tif')
+# The duplicate index is built in a background thread
+glib.threads_init()
 
 SCREEN = gtk.gdk.Screen()
 
@@ -57,6 +66,12 @@ MOVE_KEYS = {
     gtk.keysyms.l: (OFFSET_GRAL, 0),
 }
 
+# Panning is accumulated and applied at most once per frame
+PAN_FRAME_MS = 16 # ~60 fps
+KINETIC_FRICTION = 0.9 # velocity kept on each frame
+KINETIC_MIN_SPEED = 0.5 # pixels per frame
+KINETIC_RELEASE_MS = 50 # max time between last drag and release
+
 NORMAL_WINDOW = 0
 FULL_WINDOW = 1
 
@@ -88,6 +103,15 @@ class Vimg:
         self.img_zoom = 0
         self.img_mem_indexes = []
         self.img_mem_cur_index = -1 # memory empty
+        self.pan_offset_x = 0
+        self.pan_offset_y = 0
+        self.pan_source = None
+        self.pan_dragging = False
+        self.pan_last_time = 0
+        self.pan_velocity = (0, 0)
+        self.kinetic_source = None
+        self.dup_index = None
+        self.animation = None
 
         # Command line completer
         self.completer = Completer(tabkey=gtk.keysyms.Tab,
@@ -95,9 +119,11 @@ class Vimg:
 
         # Parse arguments
         (options, args) = self.parse_args()
+        self.kinetic = options.kinetic
+        self.unique = options.unique
 
         # Get images list
-        self.img_paths = self.get_images_list(args, options.recursive)
+        self.img_paths = get_images_list(args, options.recursive)
         if len(self.img_paths) == 0:
             if options.verbose:
                 print('No images found.')
@@ -105,6 +131,10 @@ class Vimg:
         elif options.verbose:
             print("%d images found." % len(self.img_paths,))
 
+        # Look for duplicates while browsing
+        if self.unique:
+            self.start_dup_index()
+
         # Label (Info)
         self.label = gtk.Label()
         #self.label.show()
@@ -165,13 +195,7 @@ class Vimg:
 
     def parse_args(self):
 
-        self.parser = OptionParser(prog="vimg",
-            description="Simple GTK Image Viewer for shell lovers.",
-            usage="%prog [OPTIONS] [FILE..|DIR]",
-            version="%%prog v%s" % VERSION)
-
-        self.parser.add_option('-r', '--recursive', action='store_true')
-        self.parser.add_option('-v', '--verbose', action='store_true')
+        self.parser = get_option_parser()
 
         (options, args) = self.parser.parse_args()
 
@@ -181,34 +205,6 @@ class Vimg:
         return (options, args)
 
 
-    def get_images_list(self, args, recursive=None):
-
-        images = []
-        # Args is a directory
-        if len(args) == 1 and os.path.isdir(args[0]):
-            dir = args[0]
-            if recursive:
-                for dirname, dirnames, filenames in os.walk(dir):
-                    for filename in filenames:
-                        if self.check_filename(filename):
-                            images.append(os.path.join(dirname, filename))
-            else:
-                for filename in os.listdir(dir):
-                    if self.check_filename(filename):
-                        images.append(os.path.join(dir, filename))
-        # Filenames
-        else:
-            for filename in args:
-                if os.path.isfile(filename) and self.check_filename(filename):
-                    images.append(filename)
-
-        return images
-
-
-    def check_filename(self, filename):
-        return filename.split('.')[-1].lower() in IMAGE_FORMATS
-
-
     def show_image(self, index, adjust=True, verbose=False):
 
         # Set actual image index
@@ -218,11 +214,21 @@ class Vimg:
             raise KeyError
             return
 
+        # Forget any pending scroll of the previous image
+        self.__stop_move()
+
         # Read actual image
+        # (animations are only probed here, they are decoded while playing)
+        path = self.img_paths[index]
+        self.pixbuf = None
         try:
-            self.pixbuf = gtk.gdk.pixbuf_new_from_file(self.img_paths[index])
-            self.img_width = self.pixbuf.get_width()
-            self.img_height = self.pixbuf.get_height()
+            info = check_animation(path) and gtk.gdk.pixbuf_get_file_info(path)
+            if info:
+                self.img_width, self.img_height = info[1:]
+            else:
+                self.pixbuf = gtk.gdk.pixbuf_new_from_file(path)
+                self.img_width = self.pixbuf.get_width()
+                self.img_height = self.pixbuf.get_height()
         except glib.GError, e:
             print("%d. %s" % (self.img_cur_index, e.message))
             return
@@ -232,7 +238,6 @@ class Vimg:
         if self.vimg_window_state == FULL_WINDOW or not adjust or \
                 (self.img_width <= DEFAULT_WIDTH
                 and self.img_height <= DEFAULT_HEIGHT):
-            self.image.set_from_pixbuf(self.pixbuf)
             self.img_scaled_width = self.img_width
             self.img_scaled_height = self.img_height
         # resize
@@ -250,10 +255,23 @@ class Vimg:
                 self.img_scaled_width = DEFAULT_WIDTH
                 self.img_scaled_height = DEFAULT_HEIGHT
 
-            scaled_buf = self.pixbuf.scale_simple(
-                self.img_scaled_width, self.img_scaled_height,
-                gtk.gdk.INTERP_BILINEAR)
-            self.image.set_from_pixbuf(scaled_buf)
+        # Animation
+        if self.pixbuf is None:
+            try:
+                self.play_animation(path)
+            except (IOError, OSError), e:
+                print("%d. %s" % (self.img_cur_index, e))
+                return
+        else:
+            self.stop_animation()
+            if self.img_scaled_width == self.img_width and \
+                    self.img_scaled_height == self.img_height:
+                self.image.set_from_pixbuf(self.pixbuf)
+            else:
+                scaled_buf = self.pixbuf.scale_simple(
+                    self.img_scaled_width, self.img_scaled_height,
+                    gtk.gdk.INTERP_BILINEAR)
+                self.image.set_from_pixbuf(scaled_buf)
 
         # Obtain actual zoom level (%)
         self.img_zoom = round(
@@ -272,46 +290,133 @@ class Vimg:
             print(self.get_image_info())
 
 
+    def play_animation(self, path):
+        # Same file at another size (e.g. fullscreen): keep playing
+        if self.animation is not None and self.animation.path == path and \
+                self.animation.mtime == os.path.getmtime(path):
+            self.animation.set_size(self.img_scaled_width,
+                                    self.img_scaled_height)
+            return
+        self.stop_animation()
+        self.image.clear()
+        animation = Animation(self.image, path,
+            self.img_scaled_width, self.img_scaled_height)
+        animation.start()
+        self.animation = animation
+
+
+    def stop_animation(self):
+        if self.animation is not None:
+            self.animation.stop()
+            self.animation = None
+
+
     def get_image_info(self):
         m = ' [M]' if self.img_cur_index in self.img_mem_indexes else ''
-        info = "%d. %s (%sx%s)%s" % (
+        info = "%d. %s (%sx%s)%s%s" % (
             self.img_cur_index, self.img_paths[self.img_cur_index],
-            self.img_width, self.img_height, m)
+            self.img_width, self.img_height, m, self.get_dup_info())
         return info
 
 
     def set_window_title(self, title=None):
         m = ' [M]' if self.img_cur_index in self.img_mem_indexes else ''
         if title == None:
-            title = '%s x %s (%s%%)%s' % (
-                self.img_width, self.img_height, self.img_zoom, m)
+            title = '%s x %s (%s%%)%s%s' % (
+                self.img_width, self.img_height, self.img_zoom, m,
+                self.get_dup_info())
         self.window.set_title(title)
 
 
+    def get_dup_info(self):
+        # [D n]: the image has n identical copies
+        if self.dup_index is None or not self.dup_index.ready.is_set():
+            return ''
+        copies = self.dup_index.get_copies(self.img_paths[self.img_cur_index])
+        return ' [D %d]' % copies if copies else ''
+
+
+    def start_dup_index(self):
+        if self.dup_index is None:
+            self.dup_index = DuplicateIndex(self.img_paths)
+            self.dup_index.start()
+
+
+    def get_next_index(self, step):
+        # In unique mode duplicates are skipped, the original
+        # of each group is always shown.
+        count = len(self.img_paths)
+        index = (self.img_cur_index + step) % count
+        if self.unique and self.dup_index is not None and \
+                self.dup_index.ready.is_set():
+            while self.dup_index.is_duplicate(self.img_paths[index]):
+                index = (index + step) % count
+        return index
+
+
+    def __queue_move(self, h_offset, v_offset):
+        # Offsets are accumulated and applied together on the next frame,
+        # so a burst of motion events or key repeats costs a single scroll.
+        self.pan_offset_x += h_offset
+        self.pan_offset_y += v_offset
+        if self.pan_source is None:
+            self.pan_source = glib.timeout_add(PAN_FRAME_MS, self.__flush_move)
+
+
+    def __flush_move(self):
+        h_offset, v_offset = self.pan_offset_x, self.pan_offset_y
+        self.pan_offset_x = self.pan_offset_y = 0
+        self.pan_source = None
+        if self.pan_dragging:
+            self.pan_velocity = (h_offset, v_offset)
+        self.__move_image(h_offset, v_offset)
+        return False
+
+
+    def __stop_move(self):
+        for source in (self.pan_source, self.kinetic_source):
+            if source is not None:
+                glib.source_remove(source)
+        self.pan_source = self.kinetic_source = None
+        self.pan_offset_x = self.pan_offset_y = 0
+        self.pan_velocity = (0, 0)
+
+
+    def __kinetic_move(self):
+        h_offset, v_offset = self.pan_velocity
+        if abs(h_offset) < KINETIC_MIN_SPEED and \
+                abs(v_offset) < KINETIC_MIN_SPEED:
+            self.pan_velocity = (0, 0)
+            self.kinetic_source = None
+            return False
+        self.__move_image(h_offset, v_offset)
+        self.pan_velocity = (h_offset * KINETIC_FRICTION,
+                             v_offset * KINETIC_FRICTION)
+        return True
+
+
     def __move_image(self, h_offset, v_offset):
-        # Horizontal
-        h_adjust = self.viewport.props.hadjustment
-        h_new = self.__get_adjust(h_adjust, h_offset)
-        self.viewport.set_hadjustment(h_new)
-        # Vertical
-        v_adjust = self.viewport.props.vadjustment
-        v_new = self.__get_adjust(v_adjust, v_offset)
-        self.viewport.set_vadjustment(v_new)
+        # Changing the adjustment value (instead of replacing the
+        # adjustment) lets the viewport scroll its window, so only the
+        # newly exposed area is redrawn.
+        if h_offset:
+            h_adjust = self.viewport.props.hadjustment
+            h_adjust.set_value(self.__get_adjust(h_adjust, h_offset))
+        if v_offset:
+            v_adjust = self.viewport.props.vadjustment
+            v_adjust.set_value(self.__get_adjust(v_adjust, v_offset))
 
 
     def __get_adjust(self, adjust, offset):
         new = adjust.value + offset
         #print(new, adjust.value, adjust.upper,
         #            adjust.lower, adjust.page_size)
-        if (new >= adjust.lower) and (
-                new <= (adjust.upper - adjust.page_size)):
-            adjust.value = new
-        elif new > 0 and new > (adjust.upper - adjust.page_size):
-            adjust.value = adjust.upper - adjust.page_size
-        elif new < adjust.lower:
-            adjust.value = adjust.lower
+        if new > adjust.upper - adjust.page_size:
+            new = adjust.upper - adjust.page_size
+        if new < adjust.lower:
+            new = adjust.lower
 
-        return adjust
+        return new
 
 
     def on_mouse_moved(self, widget, event):
@@ -324,7 +429,8 @@ class Vimg:
         if state & gtk.gdk.BUTTON1_MASK:
             offset_x = self.prevmousex - x
             offset_y = self.prevmousey - y
-            self.__move_image(offset_x, offset_y)
+            self.pan_last_time = event.time
+            self.__queue_move(offset_x, offset_y)
         self.prevmousex = x
         self.prevmousey = y
 
@@ -367,18 +473,12 @@ class Vimg:
             if (keycode == gtk.keysyms.space) or (
                     self.vimg_window_state == NORMAL_WINDOW and \
                     keycode == gtk.keysyms.j):
-                if self.img_cur_index < len(self.img_paths) -1:
-                    self.show_image(self.img_cur_index + 1, verbose=verbose)
-                else:
-                    self.show_image(0, verbose=verbose)
+                self.show_image(self.get_next_index(1), verbose=verbose)
             # PREVIOUS (backspace, k)
             elif (keycode == gtk.keysyms.BackSpace) or (
                     self.vimg_window_state == NORMAL_WINDOW and \
                     keycode == gtk.keysyms.k):
-                if self.img_cur_index == 0:
-                    self.show_image(len(self.img_paths) - 1, verbose=verbose)
-                else:
-                    self.show_image(self.img_cur_index - 1, verbose=verbose)
+                self.show_image(self.get_next_index(-1), verbose=verbose)
             # ENTER/EXIT FULL WINDOW
             elif keycode == gtk.keysyms.f:
                 if self.vimg_window_state != FULL_WINDOW:
@@ -396,7 +496,7 @@ class Vimg:
             # MOVE KEYS
             elif keycode in MOVE_KEYS.keys():
                 offset_x, offset_y = MOVE_KEYS[keycode]
-                self.__move_image(offset_x, offset_y)
+                self.__queue_move(offset_x, offset_y)
                 return True
             # MEMORY
             elif keycode == gtk.keysyms.m:
@@ -446,6 +546,13 @@ class Vimg:
                     self.label.hide()
                 else:
                     self.label.show()
+            # UNIQUE (skip duplicates)
+            elif keycode == gtk.keysyms.u:
+                self.unique = not self.unique
+                if self.unique:
+                    self.start_dup_index()
+                print("[D] Skip duplicates: %s." % (
+                                            'on' if self.unique else 'off'))
             # EDITOR
             elif keycode == gtk.keysyms.e:
                 editor = os.getenv('VIMG_EDITOR')
@@ -467,61 +574,41 @@ class Vimg:
 
     def parse_entry(self):
         entry = self.entry.get_text().split()
+        if len(entry) == 0:
+            return
 
         # Quit
         if entry[0] == ':q':
             gtk.main_quit()
             sys.exit(0)
-        # Copy
-        if entry[0] == ':cp':
-            if len(entry) != 2:
-                self.entry.set_text('E02: Target directory or filepath required')
-            else:
-                try:
-                    shutil.copy2(
-                        os.path.abspath(self.img_paths[self.img_cur_index]),
-                        os.path.abspath(entry[1]))
-                except IOError as e:
-                    self.entry.set_text(e.__str__())
-                else:
-                    self.entry.set_text('OK: File copied')
-        # Mem Copy
-        elif entry[0] == ':mcp':
-            if len(self.img_mem_indexes) == 0:
-                self.entry.set_text("E04: Memory is empty (Try `m' to add)")
-            elif len(entry) != 2:
-                self.entry.set_text('E03: Target directory required')
-            elif not os.path.exists(entry[1]):
-                self.entry.set_text('E05: Target directory do not exist')
-            elif not os.path.isdir(entry[1]):
-                self.entry.set_text('E06: Target must be a directory')
-            else:
-                filenames = []
-                for index in self.img_mem_indexes:
-                    filename = os.path.basename(self.img_paths[index])
-                    if filename in filenames:
-                        self.entry.set_text(
-                            'E07: Files have same name: Abort copy')
-                        return
-                    else:
-                        filenames.append(filename)
-                for index in self.img_mem_indexes:
-                    try:
-                        shutil.copy2(
-                            os.path.abspath(self.img_paths[index]),
-                            os.path.join(os.path.abspath(entry[1]),
-                                os.path.basename(self.img_paths[index])))
-                    except IOError as e:
-                        self.entry.set_text(e.__str__())
-                        return
-                    self.entry.set_text('OK: Files copied')
-        # Unknown
-        else:
-            self.entry.set_text('E01: Command unknown')
+        # Duplicates
+        if entry[0] == ':dups':
+            self.mark_duplicates()
+            return
+
+        mem_paths = [self.img_paths[index] for index in self.img_mem_indexes]
+        self.entry.set_text(run_command(entry,
+            self.img_paths[self.img_cur_index], mem_paths))
+
+
+    def mark_duplicates(self):
+        self.start_dup_index()
+        if not self.dup_index.ready.is_set():
+            self.entry.set_text('E09: Looking for duplicates, try again later')
+            return
+        count = add_to_memory(self.img_mem_indexes,
+                              self.dup_index.get_duplicate_indexes())
+        if count:
+            self.img_mem_cur_index = len(self.img_mem_indexes) - 1
+        self.set_window_title()
+        self.label.set_text(self.get_image_info())
+        self.entry.set_text('OK: %d duplicates added to memory' % count)
 
 
     def on_button_pressed(self, widget, event):
         if event.button == 1:
+            self.__stop_move()
+            self.pan_dragging = True
             self.change_vport_cursor(gtk.gdk.Cursor(gtk.gdk.FLEUR))
             self.prevmousex = event.x_root
             self.prevmousey = event.y_root
@@ -530,7 +617,13 @@ class Vimg:
 
     def on_button_released(self, widget, event):
         if event.button == 1:
+            self.pan_dragging = False
             self.change_vport_cursor(None)
+            # Kinetic scrolling: keep the last drag speed and let it decay
+            if self.kinetic and self.kinetic_source is None and \
+                    event.time - self.pan_last_time <= KINETIC_RELEASE_MS:
+                self.kinetic_source = glib.timeout_add(PAN_FRAME_MS,
+                                                       self.__kinetic_move)
         return True
 
 